@@ -1,12 +1,50 @@
-import requests
+import aiohttp
+import asyncio
+import csv
+import itertools
 import os
+import random
+import re
 import time
-import json
-import pandas as pd
+import orjson
 
-# GitHub API token from GitHub Actions environment variable
-TOKEN = os.getenv("TOKEN")
-headers = {'Authorization': f'token {TOKEN}'}
+# GitHub API tokens: GITHUB_TOKENS (comma-separated) multiplies the hourly
+# rate-limit budget across accounts; fall back to the single TOKEN variable
+TOKENS = [token for token in os.getenv("GITHUB_TOKENS", "").split(",") if token]
+if not TOKENS:
+    TOKENS = [os.getenv("TOKEN")]
+
+# Client-side congestion control for in-flight requests: the cap grows
+# additively while responses are healthy and halves on 429/5xx, instead of
+# hammering a throttled endpoint at a fixed concurrency
+class AdaptiveLimiter:
+    def __init__(self, start=4, minimum=1, maximum=50):
+        self.limit = float(start)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    # Additive increase on a healthy response
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 0.5)
+
+    # Multiplicative decrease when the server pushes back
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit * 0.5)
+        print(f"Throttled; reducing concurrency to {int(self.limit)}.")
+
+sem = AdaptiveLimiter(start=4, minimum=1, maximum=50)
 
 # Ensure the 'results' directory exists
 if not os.path.exists('results'):
@@ -15,192 +53,420 @@ if not os.path.exists('results'):
 # Load checkpoint if it exists
 checkpoint_file = 'results/checkpoint.json'
 try:
-    with open(checkpoint_file, 'r') as f:
-        checkpoint_data = json.load(f)
+    with open(checkpoint_file, 'rb') as f:
+        checkpoint_data = orjson.loads(f.read())
 except FileNotFoundError:
-    checkpoint_data = {'processed_repos': []}
-
-# GitHub search URL to find repositories with a Package.swift file
-search_url = "https://api.github.com/search/repositories?q=Package.swift+language:swift"
-
-# Fetch repositories with a Package.swift file
-def fetch_repositories(page=1):
-    response = requests.get(f"{search_url}&page={page}", headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"GitHub API error: {response.status_code}. Response: {response.text}")
-    return response.json()
-
-# Handle rate limit
-def check_rate_limit():
-    rate_limit_url = "https://api.github.com/rate_limit"
-    response = requests.get(rate_limit_url, headers=headers)
-    
-    # Check for a successful response (200 OK)
-    if response.status_code != 200:
-        raise Exception(f"GitHub API error: {response.status_code}. Response: {response.text}")
-    
-    # Parse JSON response
-    rate_data = response.json()
-    
-    # Print the rate limit response for debugging
-    print("Rate limit response:", rate_data)
-    
-    # Ensure 'core' or 'rate' key exists
-    if 'rate' in rate_data and 'remaining' in rate_data['rate']:
-        remaining = rate_data['rate']['remaining']
-        reset_time = rate_data['rate']['reset']
-    elif 'core' in rate_data['resources'] and 'remaining' in rate_data['resources']['core']:
-        remaining = rate_data['resources']['core']['remaining']
-        reset_time = rate_data['resources']['core']['reset']
-    else:
-        raise KeyError(f"Unexpected response structure: {rate_data}")
-    
-    # If close to the rate limit, wait for reset
-    if remaining < 5:
-        wait_time = reset_time - time.time()
-        if wait_time > 0:
-            print(f"Rate limit reached. Waiting {wait_time} seconds.")
-            time.sleep(wait_time)
-
-# Fetch the default branch of the repository
-def get_default_branch(user_name, repo_name):
-    repo_url = f"https://api.github.com/repos/{user_name}/{repo_name}"
-    response = requests.get(repo_url, headers=headers)
-
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch repository info for {user_name}/{repo_name}: {response.text}")
-    
-    repo_data = response.json()
-    return repo_data['default_branch']
-
-# Parse the Package.swift file to extract dependencies and versions
-def parse_package_swift(user_name, repo_name):
-    # Remove any trailing .git from the repository name (common in dependency URLs)
-    if repo_name.endswith('.git'):
-        repo_name = repo_name[:-4]
-    
-    # Dynamically get the default branch
-    branch = get_default_branch(user_name, repo_name)
-    package_url = f"https://raw.githubusercontent.com/{user_name}/{repo_name}/{branch}/Package.swift"
-    
-    response = requests.get(package_url, headers=headers)
-
-    if response.status_code == 200:
-        package_data = response.text
-        dependencies = extract_dependencies(package_data, repo_name)
-        return dependencies
-    else:
-        print(f"Failed to retrieve Package.swift for {user_name}/{repo_name} at {package_url}")
-        return []
+    checkpoint_data = {}
+checkpoint_data.setdefault('etags', {})
+checkpoint_data.setdefault('bodies', {})
+checkpoint_data.setdefault('links', {})
+
+# Processed repos live in an append-only NDJSON file, one name per line,
+# so checkpointing writes O(1) bytes per repo instead of the whole list
+processed_file = 'results/checkpoint.ndjson'
+try:
+    with open(processed_file, 'r') as f:
+        processed_repos = set(f.read().splitlines())
+except FileNotFoundError:
+    processed_repos = set()
+processed_fh = open(processed_file, 'a')
+
+# Fold in repos recorded by the old list-based checkpoint format, appending
+# them to the NDJSON file so they survive the end-of-run snapshot rewrite
+legacy_repos = [name for name in checkpoint_data.pop('processed_repos', [])
+                if name not in processed_repos]
+if legacy_repos:
+    for repo_name in legacy_repos:
+        processed_fh.write(repo_name + "\n")
+    processed_fh.flush()
+    processed_repos.update(legacy_repos)
+
+# Sub-dependency results cached for the whole crawl, keyed by normalized URL,
+# so popular packages like apple/swift-nio are only fetched once per run
+dep_cache_file = 'results/dep_cache.json'
+try:
+    with open(dep_cache_file, 'rb') as f:
+        _dep_cache = orjson.loads(f.read())
+except FileNotFoundError:
+    _dep_cache = {}
+
+# GitHub search URL to find repositories with a Package.swift file; 100 items
+# per page is the search API maximum, 3.3x fewer calls than the default 30
+search_url = "https://api.github.com/search/repositories?q=Package.swift+language:swift&per_page=100&sort=updated&order=desc"
+
+# GitHub GraphQL endpoint, used to batch per-repo lookups into one request
+graphql_url = "https://api.github.com/graphql"
+
+# How many repositories to alias into a single GraphQL query
+GRAPHQL_BATCH_SIZE = 100
+
+# Retry settings for transient HTTP failures
+MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+# One session and per-resource rate-limit record per token, populated by
+# process_repositories; search, core and graphql each have their own budget
+sessions = []
+rate_limits = []
+_session_cycle = None
+
+# Which GitHub rate-limit budget a URL draws from
+def rate_limit_resource(url):
+    if url == graphql_url:
+        return 'graphql'
+    if url.startswith("https://api.github.com/search/"):
+        return 'search'
+    return 'core'
+
+# Pick the next token round-robin, skipping any whose budget for this
+# resource is exhausted
+def next_session(resource):
+    for _ in range(len(sessions)):
+        index = next(_session_cycle)
+        limit = rate_limits[index].get(resource)
+        if limit is None or limit['remaining'] >= 5 or limit['reset'] <= time.time():
+            return index
+    # Every token is exhausted; fall back to the one that resets first
+    return min(range(len(sessions)), key=lambda i: rate_limits[i][resource]['reset'])
+
+# HTTP request with exponential backoff and jitter on 429/5xx, honoring Retry-After
+async def gh_request(method, url, **kwargs):
+    resource = rate_limit_resource(url)
+    index = next_session(resource)
+    session = sessions[index]
+    limit = rate_limits[index].get(resource)
+
+    # Proactively pause when even the best available budget is nearly gone
+    if limit is not None and limit['remaining'] < 5 and limit['reset'] > time.time():
+        wait_time = limit['reset'] - time.time()
+        print(f"Rate limit on '{resource}' reached on all tokens. Waiting {wait_time:.0f} seconds.")
+        await asyncio.sleep(wait_time)
+        rate_limits[index].pop(resource, None)
+
+    for attempt in range(MAX_RETRIES):
+        async with sem:
+            async with session.request(method, url, **kwargs) as response:
+                # Track this token's budget for the resource the response
+                # reports, so e.g. a fresh search reading cannot mask an
+                # exhausted graphql budget
+                if 'X-RateLimit-Remaining' in response.headers:
+                    resource_name = response.headers.get('X-RateLimit-Resource', resource)
+                    rate_limits[index][resource_name] = {
+                        'remaining': int(response.headers['X-RateLimit-Remaining']),
+                        'reset': int(response.headers['X-RateLimit-Reset']),
+                    }
+
+                if response.status == 429 or response.status >= 500:
+                    sem.on_throttle()
+                    # No point sleeping when there is no attempt left
+                    if attempt == MAX_RETRIES - 1:
+                        break
+                    # Prefer the server's own hint over our backoff schedule
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after is not None:
+                        wait_time = float(retry_after)
+                    else:
+                        wait_time = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) + random.random()
+                    print(f"Transient HTTP {response.status} for {url}. Retrying in {wait_time:.1f}s.")
+                else:
+                    sem.on_success()
+                    return response.status, response.headers, await response.text()
+        await asyncio.sleep(wait_time)
+    raise Exception(f"Giving up on {url} after {MAX_RETRIES} attempts")
+
+# GET with the same retry and rate-limit handling, plus conditional requests:
+# a 304 for a cached ETag costs no rate-limit budget, so reuse the cached body
+async def gh_get(url):
+    etag = checkpoint_data['etags'].get(url)
+    request_headers = {'If-None-Match': etag} if etag else None
+    status, response_headers, body = await gh_request('GET', url, headers=request_headers)
+
+    if status == 304:
+        # A 304 need not repeat the Link header; fall back to the one cached
+        # with the body so pagination keeps working from the cache
+        response_headers = dict(response_headers)
+        if 'Link' not in response_headers and url in checkpoint_data['links']:
+            response_headers['Link'] = checkpoint_data['links'][url]
+        return 200, response_headers, checkpoint_data['bodies'][url]
+
+    if status == 200 and 'ETag' in response_headers:
+        checkpoint_data['etags'][url] = response_headers['ETag']
+        checkpoint_data['bodies'][url] = body
+        if 'Link' in response_headers:
+            checkpoint_data['links'][url] = response_headers['Link']
+    return status, response_headers, body
+
+# POST a GraphQL query and return its 'data' payload
+async def gh_graphql(query):
+    status, _, body = await gh_request('POST', graphql_url, json={'query': query})
+    if status != 200:
+        raise Exception(f"GitHub GraphQL error: {status}. Response: {body}")
+    payload = orjson.loads(body)
+    if payload.get('data') is None:
+        raise Exception(f"GitHub GraphQL error: {payload}")
+    return payload['data']
+
+# Pull the rel="next" URL out of a Link response header, if any
+def next_page_url(link_header):
+    if not link_header:
+        return None
+    for part in link_header.split(','):
+        section = part.split(';')
+        if len(section) >= 2 and 'rel="next"' in section[1]:
+            return section[0].strip().strip('<>')
+    return None
+
+# Fetch one page of repositories with a Package.swift file, returning the
+# payload and the next page's URL from the Link header
+async def fetch_repositories(url):
+    status, response_headers, body = await gh_get(url)
+    if status != 200:
+        raise Exception(f"GitHub API error: {status}. Response: {body}")
+    return orjson.loads(body), next_page_url(response_headers.get('Link'))
+
+# Fetch Package.swift and Package.resolved for many repos in batched GraphQL
+# calls; HEAD: expressions resolve to each repo's default branch on the server,
+# so no branch lookup is needed at all
+async def fetch_packages_batch(repos):
+    chunks = [repos[start:start + GRAPHQL_BATCH_SIZE]
+              for start in range(0, len(repos), GRAPHQL_BATCH_SIZE)]
+
+    # Alias each repository so one query covers a whole chunk
+    def build_query(chunk):
+        parts = []
+        for i, (user_name, repo_name) in enumerate(chunk):
+            parts.append(
+                f'r{i}: repository(owner: "{user_name}", name: "{repo_name}") '
+                '{ manifest: object(expression: "HEAD:Package.swift") { ... on Blob { text } } '
+                'resolved: object(expression: "HEAD:Package.resolved") { ... on Blob { text } } }'
+            )
+        return "query { " + " ".join(parts) + " }"
+
+    # Run all chunks concurrently; the adaptive limiter decides how many
+    # queries are actually in flight at once
+    results = await asyncio.gather(*(gh_graphql(build_query(chunk)) for chunk in chunks))
+
+    files = {}
+    for chunk, data in zip(chunks, results):
+        for i, (user_name, repo_name) in enumerate(chunk):
+            repo_data = data.get(f'r{i}')
+            if repo_data and (repo_data.get('manifest') or repo_data.get('resolved')):
+                files[(user_name, repo_name)] = {
+                    'manifest': (repo_data.get('manifest') or {}).get('text'),
+                    'resolved': (repo_data.get('resolved') or {}).get('text'),
+                }
+            else:
+                print(f"Failed to retrieve package files for {user_name}/{repo_name}")
+    return files
+
+# Matches .package(url: "...", from: "...") declarations, including an
+# optional leading name: argument, the .upToNextMajor(from:) spelling and
+# declarations split across lines
+_DEP_RE = re.compile(
+    r'\.package\(\s*(?:name:\s*"[^"]*"\s*,\s*)?url:\s*"([^"]+)"\s*,\s*(?:\.upToNextMajor\(\s*)?from:\s*"([^"]+)"'
+)
 
 # Extract dependencies from the Package.swift file
 def extract_dependencies(package_data, repo_name):
     dependencies = []
+    for package_url, version in _DEP_RE.findall(package_data):
+        # Clean up the package_url by removing '.git' if present
+        if package_url.endswith('.git'):
+            package_url = package_url[:-4]
 
-    # The format of Package.swift includes the list of dependencies in Swift's native format
-    start_key = ".package("
-    end_key = "),"
-    
-    package_lines = package_data.splitlines()
-    for line in package_lines:
-        if start_key in line:
-            # Extract URL and version info
-            url_start = line.find("url:") + 5
-            url_end = line.find(",", url_start)
-            version_start = line.find("from:") + 6
-            version_end = line.find(")", version_start)
-
-            package_url = line[url_start:url_end].replace('"', '').strip()
-            version = line[version_start:version_end].replace('"', '').strip()
-
-            # Clean up the package_url by removing '.git' if present
-            if package_url.endswith('.git'):
-                package_url = package_url[:-4]
-
-            dependencies.append({
-                'package_url': package_url,
-                'version': version,
-                'repo_name': repo_name
-            })
+        dependencies.append({
+            'package_url': package_url,
+            'version': version,
+            'repo_name': repo_name
+        })
     return dependencies
 
-# Recursively fetch and analyze sub-dependencies
-def fetch_sub_dependencies(package_url, depth=0):
-    # Stop after a certain depth to avoid endless recursion
-    if depth > 3:
-        return []
+# Read the fully resolved pin list from Package.resolved; v1 nests pins under
+# 'object', v2+ has them at top level
+def extract_resolved_dependencies(resolved_data, repo_name):
+    dependencies = []
+    resolved = orjson.loads(resolved_data)
+    pins = resolved.get('pins') or resolved.get('object', {}).get('pins', [])
+    for pin in pins:
+        package_url = pin.get('location') or pin.get('repositoryURL', '')
+        if package_url.endswith('.git'):
+            package_url = package_url[:-4]
 
-    # Clean the package URL to extract user_name/repo_name
+        state = pin.get('state', {})
+        dependencies.append({
+            'package_url': package_url,
+            'version': state.get('version') or state.get('revision', ''),
+            'repo_name': repo_name
+        })
+    return dependencies
+
+# Extract a repo's dependencies, preferring the machine-readable
+# Package.resolved over scraping the manifest; returns (deps, had_resolved)
+def extract_package_dependencies(files, repo_name):
+    if files and files.get('resolved'):
+        try:
+            return extract_resolved_dependencies(files['resolved'], repo_name), True
+        except orjson.JSONDecodeError:
+            print(f"Malformed Package.resolved for {repo_name}, falling back to Package.swift")
+    if files and files.get('manifest'):
+        return extract_dependencies(files['manifest'], repo_name), False
+    return [], False
+
+# Normalize a package URL for cache lookups: GitHub treats owner/name
+# case-insensitively and dependency URLs often carry a trailing .git
+def normalize_package_url(package_url):
+    if package_url.endswith('.git'):
+        package_url = package_url[:-4]
+    return package_url.lower()
+
+# Clean a package URL to extract user_name/repo_name
+def split_package_url(package_url):
     repo_name = package_url.replace("https://github.com/", "")
     if repo_name.endswith('.git'):
         repo_name = repo_name[:-4]  # Remove .git if present
 
     user_name, repo_name = repo_name.split('/')
+    return user_name, repo_name
+
+# Fetch and analyze sub-dependencies for a whole page in one batched call
+async def fetch_sub_dependencies(package_urls):
+    # Only fetch packages we have not already resolved this crawl; the cache
+    # doubles as a visited-set, so dependency cycles cannot recurse
+    to_fetch = [package_url for package_url in package_urls
+                if normalize_package_url(package_url) not in _dep_cache]
+
+    repos = [split_package_url(package_url) for package_url in to_fetch]
+    files_by_repo = await fetch_packages_batch(repos)
+
+    for package_url, (user_name, repo_name) in zip(to_fetch, repos):
+        deps, _ = extract_package_dependencies(files_by_repo.get((user_name, repo_name)), repo_name)
+        _dep_cache[normalize_package_url(package_url)] = deps
 
-    return parse_package_swift(user_name, repo_name)
+    return {package_url: _dep_cache[normalize_package_url(package_url)] for package_url in package_urls}
 
-# Save progress in the checkpoint file
-def save_checkpoint(processed_repos):
-    checkpoint_data['processed_repos'] = processed_repos
-    with open(checkpoint_file, 'w') as f:
-        json.dump(checkpoint_data, f)
+# Record one processed repo in the append-only checkpoint
+def save_checkpoint(repo_name):
+    processed_fh.write(repo_name + "\n")
+    processed_fh.flush()
+
+# Serialize and write one page's result rows and checkpoint entries; runs in a
+# worker thread so disk I/O overlaps the next page's fetches
+def write_page_results(repos_writer, deps_writer, page_items, page_dependencies, all_deps):
+    for dep in all_deps:
+        # Nested sub-dependency list goes into one JSON-encoded column
+        deps_writer.writerow({**dep, 'sub_dependencies': orjson.dumps(dep['sub_dependencies']).decode()})
+
+    for repo, dependencies in zip(page_items, page_dependencies):
+        repo_info = {
+            'name': repo['name'],
+            'url': repo['html_url'],
+            'stars': repo['stargazers_count'],
+            'last_commit': repo['updated_at'],
+            'dependencies': orjson.dumps(dependencies).decode()
+        }
+        repos_writer.writerow(repo_info)
+
+        processed_repos.add(repo['full_name'])  # Add to processed set
+        save_checkpoint(repo['full_name'])  # Append to checkpoint
 
 # Main function to process repositories and analyze their dependencies
-def process_repositories():
-    page = 1
-    processed_repos = checkpoint_data['processed_repos']
-    all_data = []
-    dependency_graph = []  # To store dependency relationships
-
-    while True:
-        check_rate_limit()  # Check rate limits before each page request
-        repo_data = fetch_repositories(page)
-        
-        # Stop if no more repositories
-        if not repo_data['items']:
-            break
-        
-        for repo in repo_data['items']:
-            repo_name = repo['full_name']
-            if repo_name in processed_repos:
-                print(f"Skipping {repo_name}, already processed.")
-                continue
-
-            print(f"Processing {repo_name}...")
-
-            # Split the user name and repo name
-            user_name, repo_name = repo_name.split('/')
-            
-            # Fetch and analyze dependencies
-            dependencies = parse_package_swift(user_name, repo_name)
-            for dep in dependencies:
-                # Fetch sub-dependencies for each dependency
-                sub_deps = fetch_sub_dependencies(dep['package_url'], depth=1)
-                dep['sub_dependencies'] = sub_deps
-                dependency_graph.append(dep)
-
-            repo_info = {
-                'name': repo['name'],
-                'url': repo['html_url'],
-                'stars': repo['stargazers_count'],
-                'last_commit': repo['updated_at'],
-                'dependencies': dependencies
-            }
-            all_data.append(repo_info)
-
-            processed_repos.append(repo['full_name'])  # Add to processed list
-            save_checkpoint(processed_repos)  # Save progress to checkpoint
-
-        page += 1  # Go to the next page of repositories
-
-    # Save results to CSV
-    df_repos = pd.DataFrame(all_data)
-    df_repos.to_csv('results/swift_package_results.csv', index=False)
-    
-    df_deps = pd.DataFrame(dependency_graph)
-    df_deps.to_csv('results/swift_package_dependencies.csv', index=False)
+async def process_repositories():
+    # Stream each record to disk as it is produced, so memory stays constant
+    # and partial results survive a crash. Append mode keeps rows from an
+    # interrupted run, which the checkpoint skip logic would never re-emit
+    repos_f = open('results/swift_package_results.csv', 'a', newline='')
+    repos_writer = csv.DictWriter(repos_f, fieldnames=['name', 'url', 'stars', 'last_commit', 'dependencies'])
+    if repos_f.tell() == 0:
+        repos_writer.writeheader()
+
+    deps_f = open('results/swift_package_dependencies.csv', 'a', newline='')
+    deps_writer = csv.DictWriter(deps_f, fieldnames=['package_url', 'version', 'repo_name', 'sub_dependencies'])
+    if deps_f.tell() == 0:
+        deps_writer.writeheader()
+
+    # One session per token so each keeps its own Authorization header and warm
+    # keep-alive connection pools for api.github.com and raw.githubusercontent.com
+    global _session_cycle
+    for token in TOKENS:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=60)
+        sessions.append(aiohttp.ClientSession(headers={'Authorization': f'token {token}'}, connector=connector))
+        rate_limits.append({})
+    _session_cycle = itertools.cycle(range(len(sessions)))
+
+    write_task = None
+    next_page_task = None
+    try:
+        next_page_task = asyncio.create_task(fetch_repositories(search_url))
+        while next_page_task is not None:
+            repo_data, url = await next_page_task
+            # Start fetching the next page while this one is processed
+            next_page_task = asyncio.create_task(fetch_repositories(url)) if url else None
+
+            # Stop if no more repositories
+            if not repo_data['items']:
+                break
+
+            page_items = []
+            for repo in repo_data['items']:
+                if repo['full_name'] in processed_repos:
+                    print(f"Skipping {repo['full_name']}, already processed.")
+                    continue
+                print(f"Processing {repo['full_name']}...")
+                page_items.append(repo)
+
+            # Fetch every repo's package files on this page in one GraphQL call
+            repos = [tuple(repo['full_name'].split('/')) for repo in page_items]
+            files_by_repo = await fetch_packages_batch(repos)
+            page_dependencies = []
+            resolved_flags = []
+            for (user_name, repo_name), repo in zip(repos, page_items):
+                deps, had_resolved = extract_package_dependencies(
+                    files_by_repo.get((user_name, repo_name)), repo_name)
+                page_dependencies.append(deps)
+                resolved_flags.append(had_resolved)
+
+            # Sub-dependency fetches are only needed where we scraped the
+            # manifest; a Package.resolved pin list is already transitive
+            all_deps = [dep for dependencies in page_dependencies for dep in dependencies]
+            manifest_deps = [dep for dependencies, had_resolved in zip(page_dependencies, resolved_flags)
+                             if not had_resolved for dep in dependencies]
+            dep_urls = list(dict.fromkeys(dep['package_url'] for dep in manifest_deps))
+            sub_deps_by_url = await fetch_sub_dependencies(dep_urls)
+            for dep in all_deps:
+                dep['sub_dependencies'] = sub_deps_by_url.get(dep['package_url'], [])
+
+            # Hand this page's rows to a worker thread, waiting for the
+            # previous page's writes first so the writers are never shared
+            if write_task is not None:
+                await write_task
+            write_task = asyncio.create_task(asyncio.to_thread(
+                write_page_results, repos_writer, deps_writer, page_items, page_dependencies, all_deps))
+
+    finally:
+        if next_page_task is not None:
+            next_page_task.cancel()
+        # Flush the in-flight page write and close the result files even when
+        # a fetch fails mid-crawl, so no already-fetched rows are lost
+        if write_task is not None:
+            await write_task
+        for session in sessions:
+            await session.close()
+        repos_f.close()
+        deps_f.close()
+
+    # Snapshot the ETag and dependency caches for the next run, serializing
+    # both in parallel worker threads since they can grow large
+    def write_snapshot(path, obj):
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj))
+
+    await asyncio.gather(
+        asyncio.to_thread(write_snapshot, checkpoint_file, checkpoint_data),
+        asyncio.to_thread(write_snapshot, dep_cache_file, _dep_cache),
+    )
 
     print("Data saved to results/swift_package_results.csv and swift_package_dependencies.csv")
 
 if __name__ == "__main__":
-    process_repositories()
\ No newline at end of file
+    asyncio.run(process_repositories())